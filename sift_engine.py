@@ -8,9 +8,17 @@
 import sys
 import time
 import subprocess, os
+import signal
+import threading
+import runpy, io, traceback
+import queue, socket, re
+from contextlib import redirect_stdout, redirect_stderr
 from ast import literal_eval
 from collections import deque
+import json
+import atexit
 from sift_util import *
+from sift_store import *
 try:
     import readline
 except ImportError:
@@ -258,6 +266,143 @@ def sift_csub(cmd_list, vdc, substi_str):
 
     return cmd_list
 
+# ================================================================================
+# Evaluate an expression in-process (no extra processing layer needed)
+# ================================================================================
+def sift_eval(pred):
+    """
+    Evaluates pred as a (hobbled) python expression.
+
+    Parameters:
+        pred (str): The expression, already variable-substituted.
+
+    Returns:
+        str: The value of the expression, "NULL" if it could not be evaluated,
+             or None if it was refused (as "dangerous code").
+    """
+    pred = pred.lstrip().rstrip()
+    inquote_single = False
+    inquote_double = False
+    for idx in range(0,len(pred)):
+        if pred[idx] == '"':
+            inquote_double = False if inquote_double else True
+        if inquote_double:
+            continue
+        if pred[idx] == "'":
+            inquote_single = False if inquote_single else True
+        if inquote_single:
+            continue
+        if pred[idx] in "_gjkqvyzGHIJKLMNOPQRSTUVWYZ":
+            print("Expression Contains \"{}\": {}".format(pred[idx],pred))
+            print("Will not Evaluate")
+            return None
+
+    try:
+        rez = eval(pred)
+    except SyntaxError:
+        print("Bad Syntax!")
+        rez = "NULL"
+    except ValueError:
+        print("Bad Value!")
+        rez = "NULL"
+    except NameError:
+        print("Bad Name!")
+        rez = "NULL"
+    return str(rez)
+
+# ================================================================================
+def sift_true(rez):
+    # Same notion of truth as the "if" command
+    return rez not in ("False", "0", "0.0")
+
+# ================================================================================
+# Loop Blocks: opening command --> closing command
+# ================================================================================
+block_dict = {
+    'while':   'endwhile',
+    'for':     'endfor',
+    'foreach': 'endforeach',
+}
+
+# ================================================================================
+def while_predic8(cmd):
+    # The text after "while(" or "while (" -- or "" if this is no while
+    cmd = cmd.lstrip().strip()
+    if not match_cmd(cmd, "while"):
+        return ""
+    return grab_predic8(cmd[len("while"):].lstrip(), "", "(")
+
+# ================================================================================
+def block_word(cmd):
+    # Which (if any) Loop Block keyword begins this command
+    cmd = cmd.lstrip().strip()
+    if while_predic8(cmd) != "":
+        return "while"
+    word = cmd.split()[0] if len(cmd) > 0 else ""
+    if word != "while" and (word in block_dict or word in block_dict.values()):
+        return word
+    return ""
+
+# ================================================================================
+def sift_blocks(cmd_list):
+    """
+    Resolves each loop block of the command list into jump offsets, once,
+    before the commands are run.
+
+    Parameters:
+        cmd_list (list): The single-line commands of the current layer.
+
+    Returns:
+        dict: Index of each opening command --> index of its closing command,
+              and index of each closing command --> index of its opening command.
+    """
+    blocks = {}
+    opened = []
+    for idx in range(0,len(cmd_list)):
+        word = block_word(cmd_list[idx])
+        if word in block_dict:
+            opened.append((word, idx))
+        elif word != "":
+            if len(opened) == 0 or block_dict[opened[-1][0]] != word:
+                print(f"Unmatched \"{word}\" at Command {idx}")
+                continue
+            begin = opened.pop()[1]
+            blocks[begin] = idx
+            blocks[idx] = begin
+    for word, idx in opened:
+        print(f"Unmatched \"{word}\" at Command {idx}")
+    return blocks
+
+# ================================================================================
+def unquote(text):
+    # Remove one pair of surrounding quotes, if any
+    if len(text) > 1 and text[0] in ('"', "'") and text[-1] == text[0]:
+        return text[1:-1]
+    return text
+
+# ================================================================================
+def loop_items(pred):
+    # The values for a "for" loop: range( start, stop [, step] ), [ list ], or plain words
+    pred = pred.lstrip().strip()
+    rnge = grab_predic8(pred, "range", "(")
+    if rnge != "":
+        endo = find_delim_match(rnge, "(")
+        if endo < 0:
+            print(f"Bad Range: {pred}")
+            return []
+        try:
+            return [str(i) for i in range(*[int(n) for n in rnge[:endo].split(",")])]
+        except (ValueError, TypeError):
+            print(f"Bad Range: {pred}")
+            return []
+    if match_cmd(pred, "["):
+        try:
+            return [str(i) for i in literal_eval(pred)]
+        except (ValueError, SyntaxError, TypeError):
+            print(f"Bad List: {pred}")
+            return []
+    return pred.replace(",", " ").split()
+
 # ================================================================================
 module_list = {}
 
@@ -266,9 +411,377 @@ module_list["dos"]     = " "
 module_list["py"]      = "python3"
 module_list["harvest"] = "harvest"
 module_list["hunt"]    = "hunt"
+module_timeout = {}
+
+# The Script Deadline (time.monotonic() seconds), or 0 for None
+script_deadline = 0
+
+# ================================================================================
+def time_left(timeout_ms=0):
+    """
+    Works out how long the next command may take.
+
+    Parameters:
+        timeout_ms (int): The command's own timeout in miliseconds, or 0 for None.
+
+    Returns:
+        float: Seconds remaining before the timeout or the Script Deadline
+               (whichever is sooner), or None if there is neither.
+    """
+    left = None
+    if timeout_ms > 0:
+        left = timeout_ms / 1000.0
+    if script_deadline > 0:
+        until = max(script_deadline - time.monotonic(), 0.0)
+        left = until if left is None else min(left, until)
+    return left
+
+# ================================================================================
+def kill_group(proc, expired):
+    # Watchdog: kill the whole process group of an overrunning sub-process
+    expired.set()
+    try:
+        if os.name == 'nt':
+            subprocess.run(["taskkill", "/F", "/T", "/PID", str(proc.pid)],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        else:
+            os.killpg(proc.pid, signal.SIGKILL)
+    except (OSError, ProcessLookupError):
+        # Already Gone
+        pass
+
+# ================================================================================
+def sift_run(cwords, shell=False, timeout=None):
+    """
+    Runs a sub-process, guarded by a watchdog thread if there is a timeout.
+
+    Parameters:
+        cwords (list or str): The command (a string when shell is True).
+        shell (bool): Run the command through the shell.
+        timeout (float): Seconds allowed, or None to wait forever.
+
+    Returns:
+        (CompletedProcess, str): The result, and "Timeout" if the watchdog killed it,
+                                 "Interrupted" if Ctrl-C stopped it, or "" if it ended.
+    """
+    # Only with a timeout is the sub-process detached into a new session
+    # (leader of its own process group) so the watchdog can kill the group;
+    # otherwise it stays on our terminal, and gets Ctrl-C as it always did
+    detach = timeout is not None and os.name != 'nt'
+    proc = subprocess.Popen(cwords, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                            shell=shell, start_new_session=detach)
+    expired = threading.Event()
+    watchdog = None
+    if timeout is not None:
+        watchdog = threading.Timer(timeout, kill_group, [proc, expired])
+        watchdog.daemon = True
+        watchdog.start()
+    status = ""
+    try:
+        out, _ = proc.communicate()
+    except KeyboardInterrupt:
+        # Never leave the sub-process behind
+        if detach or os.name == 'nt':
+            kill_group(proc, threading.Event())
+        else:
+            proc.kill()
+        out, _ = proc.communicate()
+        status = "Interrupted"
+    finally:
+        if watchdog is not None:
+            watchdog.cancel()
+    if expired.is_set():
+        status = "Timeout"
+    return subprocess.CompletedProcess(cwords, proc.returncode, out), status
+
+# A module mapped to this runs its python script in-process, like so:
+#     module py=inproc
+PY_INPROC = "inproc"
+
+# ================================================================================
+def sift_inproc(cwords):
+    """
+    Runs a python script (or "-m <module>") inside this interpreter
+    in its own namespace, instead of starting a new python3 sub-process.
+    Modules it imports stay loaded (in sys.modules) for the next call.
+
+    Parameters:
+        cwords (list): The python3 parameters: <script> <args> OR -m <module> <args>
+
+    Returns:
+        CompletedProcess: As per subprocess.run(), with stdout and stderr together.
+    """
+    out = io.StringIO()
+    if len(cwords) == 0:
+        return subprocess.CompletedProcess(cwords, 0, b"")
+    use_module = cwords[0] == "-m" and len(cwords) > 1
+    argv = cwords[1:] if use_module else cwords
+    save_argv = sys.argv
+    save_path = list(sys.path)
+    sys.argv = list(argv)
+    if not use_module:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(argv[0])))
+    retcode = 0
+    try:
+        with redirect_stdout(out), redirect_stderr(out):
+            try:
+                if use_module:
+                    runpy.run_module(argv[0], run_name="__main__", alter_sys=True)
+                else:
+                    runpy.run_path(argv[0], run_name="__main__")
+            except SystemExit as e:
+                if e.code is None:
+                    retcode = 0
+                elif isinstance(e.code, int):
+                    retcode = e.code
+                else:
+                    print(e.code, file=sys.stderr)
+                    retcode = 1
+            except Exception:
+                traceback.print_exc()
+                retcode = 1
+    finally:
+        sys.argv = save_argv
+        sys.path[:] = save_path
+    return subprocess.CompletedProcess(["python3"] + cwords, retcode, out.getvalue().encode('utf-8'))
+
+# ================================================================================
+def store_status(reply):
+    # The $ret for a Shared Store reply
+    if reply is None:
+        return "NoStore"
+    return {"OK": "OK", "TIMEOUT": "Timeout", "NOTOWNER": "NotOwner"}.get(reply, "Bad")
+
+# ================================================================================
+# Record/Replay Cassette of Module results
+#   mode: "record" (write each result to the file) or "replay" (serve them from the tape)
+# ================================================================================
+cassette = {
+    "mode":     "",
+    "file":     None,
+    "tape":     deque(),
+    "diverged": 0
+}
+
+# ================================================================================
+def cassette_open(mode, fname):
+    """
+    Starts recording to, or replaying from, a Cassette file
+    (one JSON object per line: cmd, ret, out).
+
+    Returns:
+        bool: False if the Cassette file could not be opened.
+    """
+    try:
+        if mode == "record":
+            cassette["file"] = open(fname, 'w')
+        else:
+            with open(fname, 'r') as file:
+                for line in file:
+                    if line.strip() != "":
+                        cassette["tape"].append(json.loads(line))
+    except (IOError, ValueError):
+        print("Error: Cassette File \"" + fname + "\" cannot be used")
+        return False
+    cassette["mode"] = mode
+    return True
+
+# ================================================================================
+def cassette_record(cwords, result=None):
+    # Save the Module result just set in var_dict: the return code if it ran to the end,
+    # or else the status in $ret (Timeout, Interrupted, CmdNotFound)
+    if cassette["mode"] != "record":
+        return
+    entry = {"cmd": " ".join(cwords)}
+    if result is not None and var_dict["ret"] == str(result):
+        entry["rc"] = result.returncode
+    else:
+        entry["ret"] = var_dict["ret"]
+    entry["out"] = var_dict["subproc"]
+    cassette["file"].write(json.dumps(entry, separators=(',', ':')) + "\n")
+    cassette["file"].flush()
+
+# ================================================================================
+def cassette_replay(cwords):
+    # Set var_dict from the next Module result on the Cassette
+    cmd = " ".join(cwords)
+    if len(cassette["tape"]) == 0:
+        print(f"Replay Divergence: \"{cmd}\" is past the end of the Cassette")
+        cassette["diverged"] += 1
+        entry = {"cmd": cmd, "ret": "CmdNotFound", "out": ""}
+    else:
+        entry = cassette["tape"].popleft()
+        if entry["cmd"] != cmd:
+            print(f"Replay Divergence: \"{cmd}\" but the Cassette has \"{entry['cmd']}\"")
+            cassette["diverged"] += 1
+    if "rc" in entry:
+        # Rebuild $ret as the sub-process (or in-process) path would have set it
+        if cwords[0] == PY_INPROC:
+            args = ["python3"] + cwords[1:]
+        elif os.name == 'nt':
+            args = cmd
+        else:
+            args = cwords
+        var_dict["ret"] = str(subprocess.CompletedProcess(args, entry["rc"], entry["out"].encode('utf-8')))
+    else:
+        var_dict["ret"] = entry.get("ret", "")
+    var_dict["subproc"] = entry["out"]
+    var_dict["subout"]  = "".join((" RET ".join(var_dict["subproc"].split('\n')).split('\r')))
+
+# ================================================================================
+def cassette_close():
+    # Returns the number of Replay Divergences
+    if cassette["mode"] == "record":
+        cassette["file"].close()
+    if cassette["mode"] == "replay":
+        left = len(cassette["tape"])
+        if left > 0:
+            print(f"Replay Divergence: {left} Cassette results were never used")
+            cassette["diverged"] += 1
+        print(f"Replay Divergences: {cassette['diverged']}")
+    cassette["mode"] = ""
+    return cassette["diverged"]
+
+# ================================================================================
+# Feeds for waitfor: ("proc", name) / ("socket", host:port) --> (handle, Queue of lines)
+#                    ("file", name)                         --> [file, partial-line]
+# ================================================================================
+feed_list = {}
+
+# How many unread lines a feed keeps (the oldest are dropped beyond this)
+FEED_LINES = 10000
+
+# ================================================================================
+def feed_put(lines, line):
+    # Add to the Queue, dropping the oldest line if it is full
+    while True:
+        try:
+            lines.put_nowait(line)
+            return
+        except queue.Full:
+            try:
+                lines.get_nowait()
+            except queue.Empty:
+                pass
+
+# ================================================================================
+def feed_reader(stream, lines):
+    # Background Thread: pass each line of the stream to the Queue (None at the End)
+    try:
+        for line in iter(stream.readline, b""):
+            feed_put(lines, line.decode('utf-8', errors='replace').rstrip("\r\n"))
+    except (OSError, ValueError):
+        pass
+    feed_put(lines, None)
+
+# ================================================================================
+def feed_start(kind, name, handle, stream):
+    lines = queue.Queue(maxsize=FEED_LINES)
+    reader = threading.Thread(target=feed_reader, args=(stream, lines), daemon=True)
+    reader.start()
+    feed_list[(kind, name)] = (handle, lines)
+
+# ================================================================================
+def spawn_stop(name):
+    proc, _ = feed_list.pop(("proc", name))
+    if proc.poll() is None:
+        kill_group(proc, threading.Event())
+        try:
+            proc.wait(timeout=1.0)
+        except subprocess.TimeoutExpired:
+            pass
+
+# ================================================================================
+def sift_cleanup():
+    # Stop any background sub-processes, however the SIFT Engine ends
+    for kind, name in list(feed_list.keys()):
+        if kind == "proc":
+            spawn_stop(name)
+    store_close()
+
+atexit.register(sift_cleanup)
+
+# ================================================================================
+def sift_waitfor(pattern, kind, name, timeout=None):
+    """
+    Blocks until a line matching pattern comes from the source,
+    woken by the source itself rather than by polling (except for files).
+
+    Parameters:
+        pattern (str): Regular expression to search each line for.
+        kind (str): The source type: proc, file or socket.
+        name (str): The spawn name, file name, or host:port.
+        timeout (float): Seconds allowed, or None to wait forever.
+
+    Returns:
+        (str, str, str): Status (Match, Timeout, Closed or NoSource),
+                         the matching line and the matched text.
+    """
+    rexp = re.compile(pattern)
+    until = None if timeout is None else time.monotonic() + timeout
+
+    def remaining():
+        return None if until is None else max(until - time.monotonic(), 0.0)
+
+    if kind == "socket" and (kind, name) not in feed_list:
+        host, _, port = name.rpartition(":")
+        try:
+            sock = socket.create_connection((host, int(port)), timeout=remaining())
+        except (OSError, ValueError):
+            return "NoSource", "", ""
+        sock.settimeout(None)
+        feed_start(kind, name, sock, sock.makefile('rb'))
+    if kind == "file" and (kind, name) not in feed_list:
+        # The first waitfor on a file reads it from the beginning
+        feed_list[(kind, name)] = [None, ""]
+
+    if kind in ("proc", "socket"):
+        if (kind, name) not in feed_list:
+            return "NoSource", "", ""
+        lines = feed_list[(kind, name)][1]
+        while True:
+            try:
+                line = lines.get(timeout=remaining())
+            except queue.Empty:
+                return "Timeout", "", ""
+            if line is None:
+                # Leave the End for the next waitfor, too
+                feed_put(lines, None)
+                return "Closed", "", ""
+            found = rexp.search(line)
+            if found:
+                return "Match", line, found.group(0)
+
+    if kind == "file":
+        feed = feed_list[(kind, name)]
+        while True:
+            if feed[0] is None:
+                try:
+                    feed[0] = open(name, 'rb')
+                except IOError:
+                    # Not there (yet)
+                    pass
+            line = feed[0].readline() if feed[0] is not None else b""
+            if line.endswith(b"\n"):
+                line = feed[1] + line.decode('utf-8', errors='replace').rstrip("\r\n")
+                feed[1] = ""
+                found = rexp.search(line)
+                if found:
+                    return "Match", line, found.group(0)
+                continue
+            feed[1] += line.decode('utf-8', errors='replace')
+            left = remaining()
+            if left is not None and left <= 0:
+                return "Timeout", "", ""
+            # A plain file cannot be select()-ed: check again shortly
+            time.sleep(0.01 if left is None else min(0.01, left))
+
+    return "NoSource", "", ""
+
 # ================================================================================
 def sift_engine(layer, cmd_line):
     global var_dict
+    global script_deadline
 
     # print(f"SIFT Start Layer {layer}: {cmd_line}")
     # Prep the Engine
@@ -297,11 +810,21 @@ def sift_engine(layer, cmd_line):
     # Step 3: Split (per VDC) into individual single-line commands
     cmd_list = cmd_line.split(vdc)
 
+    # Step 4: Resolve the Loop Blocks into jump offsets (once)
+    blocks = sift_blocks(cmd_list)
+    loop_state = {}
+
     # Loop thru the commands, then interactively
     cmd_num = 0
     cmd="mada da yo"
     lineProc = True
     while lineProc:
+        if script_deadline > 0 and time.monotonic() >= script_deadline:
+            # Out of Time: every layer quits
+            print("Deadline Exceeded: Exiting Layer " + str(layer))
+            var_dict["ret"] = "Timeout"
+            break
+
         # Command-line commands first
         if len(cmd_list) > cmd_num:
             cmd = cmd_list[cmd_num]
@@ -329,6 +852,7 @@ def sift_engine(layer, cmd_line):
             # print("\t\tEmpty Cmd")
             continue
 
+        cmd_timeout = 0
         procCmd = True
         # print("Here we go!")
         while procCmd:
@@ -354,6 +878,38 @@ def sift_engine(layer, cmd_line):
                 # 'tis a request to do-nothing-get-paid
                 continue
 
+            pred = grab_predic8(cmd, "timeout")
+            if pred != "":
+                # Per-Module Timeout
+                modd = grab_predic8(pred, "module")
+                if modd != "":
+                    nomm = modd.split("=")[0].strip()
+                    msec = grab_predic8(modd, modd.split("=")[0], "=").strip()
+                    if msec == "XXX":
+                        if module_timeout.get(nomm, None) != None:
+                            del module_timeout[nomm]
+                    else:
+                        try:
+                            module_timeout[nomm] = int(msec)
+                        except ValueError:
+                            print(f"Bad Timeout: {msec}")
+                    continue
+                # Per-Command Timeout: "timeout <ms> <cmd>"
+                spread = pred.split(None, 1)
+                if len(spread) < 2:
+                    continue
+                try:
+                    cmd_timeout = int(spread[0])
+                except ValueError:
+                    print(f"Bad Timeout: {spread[0]}")
+                    continue
+                cmd = spread[1]
+                word = cmd.split()[0]
+                if word not in module_list and word not in ("sleep", "waitfor", "barrier", "lock") and not match_cmd(cmd, "if("):
+                    print(f"Ignoring timeout: Only applies to modules, sleep, waitfor, barrier and lock, not \"{word}\"")
+                procCmd = True
+                continue
+
             # Loadable Modules (like: bash, gob, blink, wisp, laugh, gnob, etc)
             cwords = cmd.split()
             module = cwords[0]
@@ -365,31 +921,189 @@ def sift_engine(layer, cmd_line):
                     cwords = [module_list[module]] + cwords
                 # print("\tCMD:\t" + cwords[0])
                 # print("\tARG:\t" + " ".join(cwords[1:]))
+                if cassette["mode"] == "replay":
+                    # Serve the result from the Cassette: no sub-process at all
+                    cassette_replay(cwords)
+                    if layer == 0:
+                        print(var_dict["subproc"], end='')
+                    continue
+                budget = time_left(cmd_timeout if cmd_timeout > 0 else module_timeout.get(module, 0))
+                if budget is not None and budget <= 0:
+                    print("Timeout: No Time Left to Run \"" + cwords[0] + "\"")
+                    var_dict["ret"] = "Timeout"
+                    var_dict["subproc"] = ""
+                    cassette_record(cwords)
+                    continue
+                result = None
                 try:
-                    if default_shell == "dos":
+                    if cwords[0] == PY_INPROC:
+                        # NOTE: The watchdog cannot stop an in-process script
+                        result, status = sift_inproc(cwords[1:]), ""
+                    elif default_shell == "dos":
                         cmd = " ".join(cwords)  # Windows CMD wants a string
                         # print(f"DOSCMD: \"{cmd}\"")
-                        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=True)
+                        result, status = sift_run(cmd, True, budget)
                     else:
-                        result = subprocess.run(cwords, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+                        result, status = sift_run(cwords, False, budget)
 
-                    var_dict["ret"]     = str(result)
+                    var_dict["ret"]     = status if status != "" else str(result)
                     var_dict["subproc"] = result.stdout.decode('utf-8')
                     var_dict["subout"]  = "".join((" RET ".join(var_dict["subproc"].split('\n')).split('\r')))
                     if layer == 0:
                         print(var_dict["subproc"], end='')
+                    if status == "Timeout":
+                        print("Timeout: Killed Sub-Process \"" + cwords[0] + "\"")
+                    if status == "Interrupted":
+                        print("\nInterrupted: Killed Sub-Process \"" + cwords[0] + "\"")
                 except IOError: 
                     print("Error: Failed to Run Sub-Process \"" + cwords[0] + "\" -- command not found")
                     var_dict["ret"] = "CmdNotFound"
                     var_dict["subproc"] = ""
+                cassette_record(cwords, result)
                 continue
 
             pred = grab_predic8(cmd, "sleep")
             if pred != "":
                 dura = int(pred)
                 dura = dura / 1000.0
+                budget = time_left(cmd_timeout)
+                if budget is not None and budget < dura:
+                    # Cut short by the timeout or the Script Deadline
+                    dura = budget
+                    var_dict["ret"] = "Timeout"
                 # print("Sleeping for " + str(dura) + "s")
-                time.sleep(dura)
+                try:
+                    time.sleep(dura)
+                except KeyboardInterrupt:
+                    print("\nSleep Interrupted")
+                continue
+
+            pred = grab_predic8(cmd, "deadline")
+            if pred != "":
+                if pred.strip() == "XXX":
+                    script_deadline = 0
+                else:
+                    try:
+                        script_deadline = time.monotonic() + int(pred) / 1000.0
+                    except ValueError:
+                        print(f"Bad Deadline: {pred}")
+                continue
+
+            pred = grab_predic8(cmd, "spawn")
+            if pred != "":
+                nomm = pred.split("=")[0].strip()
+                spcmd = grab_predic8(pred, pred.split("=")[0], "=").strip()
+                if ("proc", nomm) in feed_list:
+                    spawn_stop(nomm)
+                if spcmd == "XXX" or spcmd == "":
+                    continue
+                try:
+                    if os.name == 'nt':
+                        proc = subprocess.Popen(spcmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=True)
+                    else:
+                        proc = subprocess.Popen(spcmd.split(), stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                                start_new_session=True)
+                except IOError:
+                    print("Error: Failed to Run Sub-Process \"" + spcmd.split()[0] + "\" -- command not found")
+                    var_dict["ret"] = "CmdNotFound"
+                    continue
+                feed_start("proc", nomm, proc, proc.stdout)
+                continue
+
+            pred = grab_predic8(cmd, "waitfor")
+            if pred != "":
+                inn = pred.rfind(" in ")
+                if inn < 0:
+                    print(f"Malformed waitfor: {pred}")
+                    continue
+                pattern = unquote(pred[:inn].strip())
+                source = pred[inn+4:].split()
+                wait_ms = cmd_timeout
+                if len(source) >= 4 and source[-2] == "timeout":
+                    try:
+                        wait_ms = int(source[-1])
+                    except ValueError:
+                        print(f"Bad Timeout: {source[-1]}")
+                    source = source[:-2]
+                if len(source) != 2 or source[0] not in ("proc", "file", "socket"):
+                    print(f"Malformed waitfor: {pred}")
+                    continue
+                try:
+                    status, line, found = sift_waitfor(pattern, source[0], source[1], time_left(wait_ms))
+                except re.error:
+                    print(f"Bad Pattern: {pattern}")
+                    continue
+                except KeyboardInterrupt:
+                    print("\nWait Interrupted")
+                    status, line, found = "Interrupted", "", ""
+                if status == "NoSource":
+                    print("Error: No Source \"" + " ".join(source) + "\" to Wait For")
+                var_dict["ret"]     = status
+                var_dict["waitfor"] = line
+                var_dict["found"]   = found
+                continue
+
+            pred = grab_predic8(cmd, "shared var")
+            if pred != "":
+                varr = pred.split("=")[0].strip()
+                if "=" not in pred:
+                    # Fetch the Shared value into the global symbol
+                    reply = store_request("GET", varr)
+                    if reply is None:
+                        var_dict["ret"] = "NoStore"
+                    elif match_cmd(reply, "VAL "):
+                        var_dict[varr] = grab_predic8(reply, "VAL")
+                        var_dict["ret"] = "OK"
+                    else:
+                        if var_dict.get(varr, None) != None:
+                            del var_dict[varr]
+                        var_dict["ret"] = "NotFound"
+                    continue
+                vall = grab_predic8(pred, pred.split("=")[0], "=")
+                if vall == "XXX":
+                    reply = store_request("DEL", varr)
+                    if var_dict.get(varr, None) != None:
+                        del var_dict[varr]
+                else:
+                    reply = store_request("SET", varr, vall)
+                    var_dict[varr] = vall
+                var_dict["ret"] = "NoStore" if reply is None else "OK"
+                continue
+
+            pred = grab_predic8(cmd, "barrier")
+            if pred != "":
+                spread = pred.split()
+                if len(spread) < 2:
+                    print(f"Malformed barrier: {pred}")
+                    var_dict["ret"] = "Bad"
+                    continue
+                budget = time_left(cmd_timeout)
+                if budget is not None and budget <= 0:
+                    var_dict["ret"] = "Timeout"
+                    continue
+                reply = store_request("BARRIER", spread[0],
+                                      spread[1] + ("" if budget is None else f" {budget:.3f}"))
+                var_dict["ret"] = store_status(reply)
+                if reply == "BAD":
+                    print(f"Bad Barrier Count: {spread[1]}")
+                continue
+
+            pred = grab_predic8(cmd, "lock")
+            if pred != "":
+                budget = time_left(cmd_timeout)
+                if budget is not None and budget <= 0:
+                    var_dict["ret"] = "Timeout"
+                    continue
+                reply = store_request("LOCK", pred.split()[0], None if budget is None else f"{budget:.3f}")
+                var_dict["ret"] = store_status(reply)
+                continue
+
+            pred = grab_predic8(cmd, "unlock")
+            if pred != "":
+                reply = store_request("UNLOCK", pred.split()[0])
+                var_dict["ret"] = store_status(reply)
+                if reply == "NOTOWNER":
+                    print("Lock \"" + pred.split()[0] + "\" is not held")
                 continue
 
             if match_cmd(cmd, "echo"):
@@ -565,6 +1279,153 @@ def sift_engine(layer, cmd_line):
                 # print(f"                     Return  to  {cmd_num}")
                 continue
 
+            pred = while_predic8(cmd)
+            if pred != "":
+                here = cmd_num - 1
+                if blocks.get(here, -1) < here:
+                    print("FAILED to Find endwhile")
+                    continue
+                endo = find_delim_match(pred, "(")
+                if endo < 0:
+                    print(f"Malformed Expression: {pred}")
+                    cmd_num = blocks[here] + 1
+                    continue
+                rez = sift_eval(pred[:endo])
+                if rez is None or rez == "NULL":
+                    # A bad expression must not loop forever
+                    print(f"Leaving Loop: Cannot Evaluate ({pred[:endo].strip()})")
+                    cmd_num = blocks[here] + 1
+                elif not sift_true(rez):
+                    # Done: resume after the endwhile
+                    cmd_num = blocks[here] + 1
+                continue
+
+            if match_cmd(cmd, "endwhile"):
+                here = cmd_num - 1
+                if blocks.get(here, here) >= here:
+                    print("FAILED to Find while")
+                    continue
+                # Back to the while, to re-evaluate its expression
+                cmd_num = blocks[here]
+                continue
+
+            if block_word(cmd) == "for":
+                pred = cmd[len("for"):].strip()
+                here = cmd_num - 1
+                if blocks.get(here, -1) < here:
+                    print("FAILED to Find endfor")
+                    continue
+                spread = pred.split(None, 2)
+                if len(spread) < 2 or spread[1] != "in":
+                    print(f"Malformed Loop: for {pred}")
+                    cmd_num = blocks[here] + 1
+                    continue
+                varr = spread[0]
+                # Nothing after "in" (e.g. an empty $NodeList) is an empty list
+                items = loop_items(spread[2] if len(spread) > 2 else "")
+                if len(items) == 0:
+                    cmd_num = blocks[here] + 1
+                    continue
+                var_dict[varr] = items[0]
+                loop_state[here] = (varr, items, 1)
+                continue
+
+            if block_word(cmd) == "endfor":
+                here = cmd_num - 1
+                if blocks.get(here, here) >= here:
+                    print("FAILED to Find for")
+                    continue
+                begin = blocks[here]
+                varr, items, nxt = loop_state.get(begin, ("", [], 0))
+                if nxt < len(items):
+                    var_dict[varr] = items[nxt]
+                    loop_state[begin] = (varr, items, nxt + 1)
+                    cmd_num = begin + 1
+                else:
+                    loop_state.pop(begin, None)
+                continue
+
+            if block_word(cmd) == "foreach":
+                pred = cmd[len("foreach"):].strip()
+                here = cmd_num - 1
+                if blocks.get(here, -1) < here:
+                    print("FAILED to Find endforeach")
+                    continue
+                spread = pred.split()
+                if len(spread) < 4 or spread[1] != "in" or spread[2] != "file":
+                    print(f"Malformed Loop: foreach {pred}")
+                    cmd_num = blocks[here] + 1
+                    continue
+                varr  = spread[0]
+                fname = spread[3]
+                offset  = 0
+                pattern = ""
+                use_mmap = False
+                bad = False
+                otext = "0"
+                idx = 4
+                while idx < len(spread):
+                    if spread[idx] == "from" and idx + 1 < len(spread):
+                        otext = spread[idx+1]
+                        try:
+                            offset = int(otext)
+                        except ValueError:
+                            offset = -1
+                        idx += 2
+                    elif spread[idx] == "mmap":
+                        use_mmap = True
+                        idx += 1
+                    elif spread[idx] == "match":
+                        # The pattern is the rest of the command, exactly as written
+                        words = list(re.finditer(r"\S+", pred))
+                        pattern = unquote(pred[words[idx].end():].strip())
+                        break
+                    else:
+                        print(f"Ignoring \"{spread[idx]}\"")
+                        idx += 1
+                try:
+                    re.compile(pattern)
+                except re.error:
+                    print(f"Bad Pattern: {pattern}")
+                    bad = True
+                try:
+                    if offset < 0 or offset > os.path.getsize(fname):
+                        print(f"Bad Offset: {otext}")
+                        bad = True
+                except OSError:
+                    print("Error: Text File \"" + fname + "\" not found")
+                    bad = True
+                if bad:
+                    cmd_num = blocks[here] + 1
+                    continue
+                lines = file_lines(fname, offset, pattern, use_mmap)
+                try:
+                    line = next(lines, None)
+                except IOError:
+                    print("Error: Text File \"" + fname + "\" not found")
+                    line = None
+                if line is None:
+                    cmd_num = blocks[here] + 1
+                    continue
+                var_dict[varr] = line
+                loop_state[here] = (varr, lines)
+                continue
+
+            if match_cmd(cmd, "endforeach"):
+                here = cmd_num - 1
+                if blocks.get(here, here) >= here:
+                    print("FAILED to Find foreach")
+                    continue
+                begin = blocks[here]
+                varr, lines = loop_state.get(begin, ("", iter(())))
+                line = next(lines, None)
+                if line is not None:
+                    var_dict[varr] = line
+                    cmd_num = begin + 1
+                else:
+                    loop_state.pop(begin, None)
+                continue
+
             pred = grab_predic8(cmd, "eval", "(")
             if pred != "":
                 try:
@@ -573,45 +1434,14 @@ def sift_engine(layer, cmd_line):
                     print(f"Malformed Expression: {pred}")
                     continue
                 pred = pred[:endo]
-                pred = pred.lstrip().rstrip()
                 # print(f"Requested Evaluation: ({pred})")
-                clean_str = True
-                skipstr = pred
-                inquote_single = False
-                inquote_double = False
-                for idx in range(0,len(skipstr)):
-                    if pred[idx] == '"':
-                        inquote_double = False if inquote_double else True
-                    if inquote_double:
-                        continue
-                    if pred[idx] == "'":
-                        inquote_single = False if inquote_single else True
-                    if inquote_single:
-                        continue
-                    if pred[idx] in "_gjkqvyzGHIJKLMNOPQRSTUVWYZ":
-                        print("Expression Contains \"{}\": {}".format(pred[idx],pred))
-                        print("Will not Evaluate")
-                        clean_str = False
-                        break
-                if not clean_str:
+                rez = sift_eval(pred)
+                if rez is None:
+                    # Refused: leave $result as it was
                     continue
-
-                # print("Evaluating ({})".format(pred))
-                try:
-                    rez = eval(pred)
-                    # print(f"EVAL({pred}) --> \"{rez}\"")
-                except SyntaxError:
-                    print("Bad Syntax!")
-                    rez = "NULL"
-                except ValueError:
-                    print("Bad Value!")
-                    rez = "NULL"
-                except NameError:
-                    print("Bad Name!")
-                    rez = "NULL"
                 if layer == 0:
                     print("Result is: {}".format(rez))
-                var_dict["result"] = str(rez)
+                var_dict["result"] = rez
                 continue
 
             pred = grab_predic8(cmd, "if", "(")
@@ -676,6 +1506,7 @@ def sift_engine(layer, cmd_line):
         # print("Exiting Layer " + str(layer))
         return
     else:
+        sift_cleanup()
         print("========================================")
         print("Exiting SIFT Engine")
         print("========================================")
@@ -685,11 +1516,23 @@ def sift_engine(layer, cmd_line):
 if __name__ == '__main__':
     # print(sys.argv)
     cmd_line = ""
-    if len(sys.argv) > 1:
-        # print(sys.argv[1:])
+    args = sys.argv[1:]
+    # Options: --record <cassette-file>  OR  --replay <cassette-file>
+    while len(args) > 1 and args[0] in ("--record", "--replay"):
+        if cassette["mode"] != "":
+            print("Error: Only one of --record and --replay can be used")
+            sys.exit(1)
+        if not cassette_open(args[0][2:], args[1]):
+            sys.exit(1)
+        args = args[2:]
+    if len(args) > 0:
+        # print(args)
         # Get the list of commands
-        cmd_line=' '.join(sys.argv[1:])
+        cmd_line=' '.join(args)
         # print("CmdLine: \"" + cmd_line + "\"")
     sift_engine(0, cmd_line)
+    if cassette_close() > 0:
+        # A divergent Replay is a failed run
+        sys.exit(1)
 
 # ================================================================================
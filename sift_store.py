@@ -0,0 +1,319 @@
+# ================================================================================
+# sift_store.py
+# The Shared Store for SIFT Engines running side-by-side:
+# shared variables, locks and barriers, served over a Unix socket
+#
+# The first SIFT Engine to need the Store starts it as a background process,
+# which exits a few seconds after its last SIFT Engine has disconnected
+#
+# Run directly:   python3 sift_store.py [ socket-path ]
+# ================================================================================
+import os
+import sys
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ================================================================================
+# How long the Store lingers with no SIFT Engines connected (seconds)
+STORE_LINGER = 5.0
+
+# How often a waiting LOCK or BARRIER checks its SIFT Engine is still there (seconds)
+STORE_CHECK = 0.25
+
+# ================================================================================
+def store_path():
+    # The Store's socket: $SIFT_STORE, or else one private to this user:
+    # sift_store.sock in $XDG_RUNTIME_DIR, or sift_store-<uid>.sock in the temp directory
+    if "SIFT_STORE" in os.environ:
+        return os.environ["SIFT_STORE"]
+    if os.environ.get("XDG_RUNTIME_DIR", "") != "":
+        return os.path.join(os.environ["XDG_RUNTIME_DIR"], "sift_store.sock")
+    return os.path.join(tempfile.gettempdir(), f"sift_store-{os.getuid()}.sock")
+
+# ================================================================================
+def store_mine(path):
+    # Only trust a socket (or lock file) that this user owns
+    try:
+        return os.lstat(path).st_uid == os.getuid()
+    except OSError:
+        return False
+
+# ================================================================================
+# Server Side
+# ================================================================================
+store = {
+    "vars":     {},       # name --> value
+    "locks":    {},       # name --> owning connection
+    "barriers": {},       # name --> [ arrived, generation ]
+    "clients":  0,
+    "idle":     time.monotonic()    # when the last SIFT Engine disconnected
+}
+store_cond = threading.Condition()
+
+# ================================================================================
+def store_gone(conn):
+    # Has this SIFT Engine disconnected?  (It sends nothing while it waits)
+    try:
+        return conn.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b""
+    except BlockingIOError:
+        return False
+    except OSError:
+        return True
+
+# ================================================================================
+def store_until(args):
+    # When a wait with an (optional) limit of args[0] seconds must end, or None
+    try:
+        return time.monotonic() + float(args[0])
+    except (IndexError, ValueError):
+        return None
+
+# ================================================================================
+def store_left(until):
+    return None if until is None else until - time.monotonic()
+
+# ================================================================================
+def store_do(conn, words):
+    """
+    Carries out one request for a connection, blocking for LOCK and BARRIER.
+
+    Parameters:
+        conn (socket): The requesting connection (owner of any lock it takes).
+        words (list): The request: <op> <name> [ <value> ]
+
+    Returns:
+        str: The reply line, or None if the SIFT Engine gave up waiting.
+    """
+    op   = words[0] if len(words) > 0 else ""
+    name = words[1] if len(words) > 1 else ""
+    with store_cond:
+        if op == "SET":
+            store["vars"][name] = words[2] if len(words) > 2 else ""
+            return "OK"
+        if op == "DEL":
+            store["vars"].pop(name, None)
+            return "OK"
+        if op == "GET":
+            if name not in store["vars"]:
+                return "NONE"
+            return "VAL " + store["vars"][name]
+        if op == "LOCK":
+            # Optional: LOCK <name> <seconds-allowed>
+            until = store_until(words[2:])
+            while store["locks"].get(name, conn) is not conn:
+                left = store_left(until)
+                if left is not None and left <= 0:
+                    return "TIMEOUT"
+                store_cond.wait(STORE_CHECK if left is None else min(STORE_CHECK, left))
+                if store_gone(conn):
+                    return None
+            store["locks"][name] = conn
+            return "OK"
+        if op == "UNLOCK":
+            if store["locks"].get(name, None) is not conn:
+                return "NOTOWNER"
+            del store["locks"][name]
+            store_cond.notify_all()
+            return "OK"
+        if op == "BARRIER":
+            # BARRIER <name> <count> [ <seconds-allowed> ]
+            args = words[2].split() if len(words) > 2 else []
+            try:
+                count = int(args[0])
+            except (IndexError, ValueError):
+                return "BAD"
+            until = store_until(args[1:])
+            barrier = store["barriers"].setdefault(name, [0, 0])
+            generation = barrier[1]
+            barrier[0] += 1
+            if barrier[0] >= count:
+                # Last to arrive: release everyone
+                barrier[0] = 0
+                barrier[1] += 1
+                store_cond.notify_all()
+            while barrier[1] == generation:
+                left = store_left(until)
+                if left is not None and left <= 0:
+                    # Out of time: take back its arrival
+                    barrier[0] -= 1
+                    return "TIMEOUT"
+                store_cond.wait(STORE_CHECK if left is None else min(STORE_CHECK, left))
+                if barrier[1] == generation and store_gone(conn):
+                    # Gave up: take back its arrival
+                    barrier[0] -= 1
+                    return None
+            return "OK"
+    return "BAD"
+
+# ================================================================================
+def store_client(conn):
+    # Server Thread: one per connected SIFT Engine
+    fyle = conn.makefile('rb')
+    try:
+        for line in fyle:
+            words = line.decode('utf-8').rstrip("\r\n").split(" ", 2)
+            reply = store_do(conn, words)
+            if reply is None:
+                break
+            conn.sendall((reply + "\n").encode('utf-8'))
+    except OSError:
+        pass
+    finally:
+        with store_cond:
+            # Locks die with their owner
+            for name in [n for n, c in store["locks"].items() if c is conn]:
+                del store["locks"][name]
+            store["clients"] -= 1
+            if store["clients"] == 0:
+                store["idle"] = time.monotonic()
+            store_cond.notify_all()
+        fyle.close()
+        conn.close()
+
+# ================================================================================
+def store_serve(path):
+    # Nothing the Store creates is for other users
+    os.umask(0o077)
+    # Only one Store per socket path: the lock file is held for the Store's life
+    try:
+        guard = os.open(path + ".lock", os.O_WRONLY | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+    except OSError:
+        return
+    if not store_mine(path + ".lock"):
+        os.close(guard)
+        return
+    try:
+        fcntl.flock(guard, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(guard)
+        return
+    if os.path.lexists(path):
+        if not store_mine(path):
+            os.close(guard)
+            return
+        # Left behind by a Store that did not exit cleanly
+        os.unlink(path)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    os.chmod(path, 0o600)
+    listener.listen(16)
+    listener.settimeout(STORE_LINGER / 5)
+    store["idle"] = time.monotonic()
+    while True:
+        try:
+            conn, _ = listener.accept()
+        except socket.timeout:
+            with store_cond:
+                if store["clients"] == 0 and time.monotonic() - store["idle"] >= STORE_LINGER:
+                    break
+            continue
+        conn.settimeout(None)
+        with store_cond:
+            store["clients"] += 1
+        threading.Thread(target=store_client, args=(conn,), daemon=True).start()
+    listener.close()
+    os.unlink(path)
+    os.unlink(path + ".lock")
+    os.close(guard)
+
+# ================================================================================
+# Client Side (used by the SIFT Engine)
+# ================================================================================
+store_conn = {
+    "sock": None,
+    "file": None
+}
+
+# ================================================================================
+def store_connect():
+    """
+    Connects to the Store, starting it first if need be.
+
+    Returns:
+        bool: False if the Store could not be reached.
+    """
+    if store_conn["sock"] is not None:
+        return True
+    if fcntl is None or not hasattr(socket, "AF_UNIX"):
+        print("Error: The Shared Store needs Unix sockets")
+        return False
+    path = store_path()
+    started = False
+    until = time.monotonic() + 2.0
+    while True:
+        if os.path.lexists(path) and not store_mine(path):
+            print("Error: Shared Store \"" + path + "\" belongs to another user")
+            return False
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(path)
+            break
+        except OSError:
+            sock.close()
+        if time.monotonic() >= until:
+            print("Error: Shared Store \"" + path + "\" not available")
+            return False
+        if not started:
+            subprocess.Popen([sys.executable, os.path.abspath(__file__), path],
+                             stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                             stderr=subprocess.DEVNULL, start_new_session=True)
+            started = True
+        time.sleep(0.01)
+    store_conn["sock"] = sock
+    store_conn["file"] = sock.makefile('rb')
+    return True
+
+# ================================================================================
+def store_close():
+    if store_conn["sock"] is not None:
+        store_conn["file"].close()
+        store_conn["sock"].close()
+    store_conn["sock"] = None
+    store_conn["file"] = None
+
+# ================================================================================
+def store_request(op, name, value=None):
+    """
+    Sends one request to the Store and waits for the reply
+    (LOCK and BARRIER wait until they are granted, or their time is up).
+
+    Parameters:
+        op (str): SET, DEL, GET, LOCK, UNLOCK or BARRIER.
+        name (str): The variable, lock or barrier name.
+        value (str): The value for SET, "<count> [ <seconds> ]" for BARRIER,
+                     or "<seconds>" allowed for LOCK.
+
+    Returns:
+        str: The reply (OK, VAL <value>, NONE, NOTOWNER, TIMEOUT, BAD), or None on failure.
+    """
+    if not store_connect():
+        return None
+    line = op + " " + name + ("" if value is None else " " + str(value))
+    line = line.replace("\r", " ").replace("\n", " ")
+    try:
+        store_conn["sock"].sendall((line + "\n").encode('utf-8'))
+        reply = store_conn["file"].readline()
+    except OSError:
+        reply = b""
+    except KeyboardInterrupt:
+        print("\nShared Store Request Interrupted")
+        store_close()
+        return None
+    if not reply:
+        print("Error: Lost the Shared Store")
+        store_close()
+        return None
+    return reply.decode('utf-8').rstrip("\r\n")
+
+# ================================================================================
+if __name__ == '__main__':
+    store_serve(sys.argv[1] if len(sys.argv) > 1 else store_path())
+
+# ================================================================================
@@ -7,6 +7,8 @@
 # Created: 25 APR 2023
 # ================================================================================
 import inspect
+import mmap
+import re
 
 # ================================================================================
 def currFunc(): 
@@ -46,6 +48,48 @@ def file_text(filename):
     fyle.close()
     return text
 
+# ================================================================================
+# Given a (possibly very large) File, Stream it one line at a time
+# without ever holding the whole file in memory
+# ================================================================================
+def file_lines(filename, offset=0, pattern="", use_mmap=False):
+    """
+    Yields the lines of a file (without the line ending).
+
+    Parameters:
+        filename (str): The file to read.
+        offset (int): Byte offset to start from (a partial first line is skipped).
+        pattern (str): If given, only lines matching this regular expression.
+        use_mmap (bool): Read through a memory map rather than buffered reads.
+    """
+    rexp = re.compile(pattern) if pattern != "" else None
+    with open(filename, 'rb') as fyle:
+        if use_mmap:
+            try:
+                fyle = mmap.mmap(fyle.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Cannot map an empty file
+                return
+        if offset > 0:
+            fyle.seek(0, 2)
+            if offset > fyle.tell():
+                # Nothing beyond the end
+                return
+            fyle.seek(offset - 1)
+            if fyle.read(1) != b"\n":
+                fyle.readline()
+        try:
+            while True:
+                line = fyle.readline()
+                if not line:
+                    break
+                line = line.decode('utf-8', errors='replace').rstrip("\r\n")
+                if rexp is None or rexp.search(line):
+                    yield line
+        finally:
+            if use_mmap:
+                fyle.close()
+
 # ================================================================================
 # Given a (possibly quite long) Text String, Search it for a Key
 # Then, if found, assuming some syntactical elements (as per JSON)